@@ -8,11 +8,13 @@ if len( sys.argv ) < 2:
     print( "Please specify the folder containing the benchmark logs!" )
 folder = sys.argv[1]
 suffix = '-full-first-read.log'
-benchmarkLogs = [ os.path.join( folder, file ) for file in os.listdir( folder ) if file.endswith( suffix ) ]
+with os.scandir( folder ) as entries:
+    benchmarkLogs = [ entry.path for entry in entries if entry.name.endswith( suffix ) and entry.is_file() ]
 
 # Return compilerName and lists of min, max, avg values per commit
 def loadData( filePath ):
     commits = []
+    seenCommits = set()
     minTimes = []
     avgTimes = []
     maxTimes = []
@@ -27,8 +29,9 @@ def loadData( filePath ):
                 continue
 
             commit = tokens[0][20:-1]
-            if commit in commits:
+            if commit in seenCommits:
                 continue
+            seenCommits.add( commit )
             commits += [ commit ]
             if '+-' in tokens:
                 # version 1: [2020-12-06T21-36][bccbedc] 10.164 <= 10.294 +- 0.105 <= 10.475 at version unknown
@@ -37,7 +40,7 @@ def loadData( filePath ):
                 maxTimes += [ float( tokens[7] ) ]
             else:
                 # version 2: [2020-12-06T23-01][9ca572f] 8.42 8.34 8.49 8.67 8.58
-                times = np.array( [ float( t ) for t in tokens[1:] ] )
+                times = np.array( tokens[1:], dtype = float )
                 minTimes += [ np.min( times ) ]
                 avgTimes += [ np.mean( times ) ]
                 maxTimes += [ np.max( times ) ]
@@ -6,7 +6,7 @@ import sys
 
 file = sys.argv[1]  # "counts-2B.dat"
 
-data = np.genfromtxt( file, dtype = 'int' ).transpose()
+data = np.loadtxt( file, dtype = 'int' ).transpose()
 
 fig = plt.figure()
 ax = fig.add_subplot( 111, yscale = 'log' )
@@ -2,12 +2,19 @@
 # -*- coding: utf-8 -*-
 
 import os
+import shutil
 import sys
 
 from setuptools import setup
 from setuptools.extension import Extension
 from setuptools.command.build_ext import build_ext
 
+# Python 3.12 removed distutils, but setuptools >= 59 re-exports the exception of the distutils it uses.
+try:
+    from setuptools.errors import CompileError
+except ImportError:
+    from distutils.errors import CompileError
+
 
 buildCython = '--cython' in sys.argv
 
@@ -49,10 +56,118 @@ link_args = [
 
 # https://github.com/cython/cython/blob/master/docs/src/tutorial/appendix.rst#python-38
 class Build(build_ext):
+    # Maps ( compiler command, flag ) to the probe result, so that each flag is only probed once per compiler.
+    flagSupportCache = {}
+
+    def supportsFlag(self, flag):
+        key = ( tuple( self.compiler.compiler_so ), flag )
+        if key not in Build.flagSupportCache:
+            Build.flagSupportCache[key] = self._probeFlag( flag )
+        return Build.flagSupportCache[key]
+
+    def _probeFlag(self, flag):
+        # Write the probe once into the build folder instead of using a NamedTemporaryFile per probe,
+        # which cannot be opened a second time by the compiler on Windows while it is still open.
+        probePath = os.path.join( self.build_temp, 'probe-flag-support.cpp' )
+        if not os.path.exists( probePath ):
+            os.makedirs( self.build_temp, exist_ok = True )
+            with open( probePath, 'wt' ) as file:
+                file.write( 'int main() { return 0; }' )
+
+        # Compile from inside build_temp so that the object is placed right next to the probe source.
+        # Specifying an output_dir instead would mirror the source path below it, e.g., build/temp.*/build/temp.*/.
+        oldWorkingDirectory = os.getcwd()
+        os.chdir( self.build_temp )
+        try:
+            self.compiler.compile( [ os.path.basename( probePath ) ], extra_postargs = [ flag ] )
+        except CompileError:
+            print( "[Info] Compiler does not support " + flag + "; it will not be used. "
+                   "The above error can be ignored!" )
+            return False
+        finally:
+            os.chdir( oldWorkingDirectory )
+        return True
+
     def build_extensions(self):
-        if self.compiler.compiler_type == 'mingw32':
-            for e in self.extensions:
-                e.extra_link_args = link_args
+        # Opt-in compiler cache to speed up repeated rebuilds, e.g., while bisecting performance regressions.
+        if os.environ.get( 'INDEXED_BZIP2_USE_CCACHE', '0' ) == '1':
+            launcher = shutil.which( 'ccache' ) or shutil.which( 'sccache' )
+            if launcher:
+                # Only wrap the compile commands. Older distutils links C++ by replacing linker_so[0] with
+                # compiler_cxx[0], which would turn the launcher itself into the linker. Newer setuptools
+                # compiles C++ sources with compiler_so_cxx.
+                for name in [ 'compiler_so', 'compiler_so_cxx' ]:
+                    command = getattr( self.compiler, name, None )
+                    if command and os.path.basename( command[0] ) not in [ 'ccache', 'sccache' ]:
+                        setattr( self.compiler, name, [ launcher ] + list( command ) )
+            else:
+                print( "[Warning] INDEXED_BZIP2_USE_CCACHE is set but neither ccache nor sccache could be found!" )
+
+        # Determine the arguments once because they are the same for all extensions.
+        compileArgs = []
+        linkArgs = list( link_args ) if self.compiler.compiler_type == 'mingw32' else []
+
+        # Calls between functions inside the shared library do not have to go through the PLT/GOT
+        # and can be inlined because nobody is allowed to interpose them via LD_PRELOAD anyway.
+        if self.supportsFlag( '-fno-semantic-interposition' ):
+            compileArgs += [ '-fno-semantic-interposition' ]
+
+        # Only the module init function needs to be exported. Before Python 3.9, PyMODINIT_FUNC did not
+        # explicitly set the default visibility, so the init function would become hidden, too.
+        if sys.version_info >= ( 3, 9 ):
+            for flag in [ '-fvisibility=hidden', '-fvisibility-inlines-hidden' ]:
+                if self.supportsFlag( flag ):
+                    compileArgs += [ flag ]
+
+        # Call external functions like memcpy directly via the GOT instead of via lazily bound PLT stubs.
+        # This requires all symbols to be bound when loading the module, which is what '-z now' does.
+        if sys.platform.startswith( 'linux' ):
+            if self.supportsFlag( '-fno-plt' ):
+                compileArgs += [ '-fno-plt' ]
+            linkArgs += [ '-Wl,-z,now', '-Wl,-z,relro' ]
+
+        # Opt-in because it makes debugging the shipped extension harder.
+        if os.environ.get( 'INDEXED_BZIP2_STRIP', '0' ) == '1':
+            linkArgs += [ '-s' ]
+
+        # Put each function and object into its own section so that the linker can drop unused ones.
+        # This should mainly help the mingw32 builds, which link libstdc++ statically.
+        if self.compiler.compiler_type in [ 'unix', 'mingw32' ]:
+            sectionFlags = [ flag for flag in [ '-ffunction-sections', '-fdata-sections' ]
+                             if self.supportsFlag( flag ) ]
+            if sectionFlags:
+                compileArgs += sectionFlags
+                linkArgs += [ '-Wl,-dead_strip' if sys.platform == 'darwin' else '-Wl,--gc-sections' ]
+
+        # Opt-in for local builds only because the resulting binary might not run on other, older CPUs.
+        if os.environ.get( 'INDEXED_BZIP2_BUILD_NATIVE', '0' ) == '1':
+            for flag in [ '-march=native', '-mtune=native' ]:
+                if self.supportsFlag( flag ):
+                    compileArgs += [ flag ]
+
+        # Opt-in profile-guided optimization. Build with 'generate', decompress representative bzip2 files
+        # to record branch and call statistics, then rebuild with 'use'.
+        pgoMode = os.environ.get( 'INDEXED_BZIP2_BUILD_PGO', '' )
+        if pgoMode:
+            pgoFolder = os.path.abspath( os.environ.get( 'INDEXED_BZIP2_PGO_DIR',
+                                                         os.path.join( self.build_temp, 'pgo' ) ) )
+            if pgoMode == 'generate':
+                pgoFlags = [ '-fprofile-generate=' + pgoFolder ]
+            elif pgoMode == 'use':
+                pgoFlags = [ '-fprofile-use=' + pgoFolder ]
+                # Profiles recorded with the multi-threaded ParallelBZ2Reader may contain inconsistent counters.
+                if self.supportsFlag( '-fprofile-correction' ):
+                    pgoFlags += [ '-fprofile-correction' ]
+            else:
+                raise ValueError( "INDEXED_BZIP2_BUILD_PGO must be either 'generate' or 'use' but is: " + pgoMode )
+
+            compileArgs += pgoFlags
+            linkArgs += pgoFlags
+
+        for e in self.extensions:
+            e.extra_compile_args += compileArgs
+            e.extra_link_args += linkArgs
+
         super(Build, self).build_extensions()
 
 